@@ -9,7 +9,9 @@ import numpy as np
 import pandas as pd
 import requests
 from dotenv import load_dotenv
-from sklearn.ensemble import HistGradientBoostingRegressor
+from joblib import Parallel, delayed
+from lightgbm import LGBMRegressor
+from requests.adapters import HTTPAdapter
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score, mean_absolute_error, mean_squared_error, r2_score
 from sklearn.pipeline import Pipeline
@@ -17,6 +19,8 @@ from sklearn.preprocessing import StandardScaler
 
 MODELS_DIR = Path("ml-models")
 MODELS_DIR.mkdir(exist_ok=True)
+# Raw close history from previous runs; only newer rows are fetched from Supabase.
+HISTORY_CACHE = MODELS_DIR / "history.parquet"
 
 load_dotenv(".env.local")
 load_dotenv()
@@ -32,6 +36,11 @@ HEADERS = {
   "Authorization": f"Bearer {SUPABASE_ANON_KEY}",
 }
 
+# Shared keep-alive session so paged history requests reuse pooled TLS connections to Supabase.
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+
 CRYPTO_TICKERS = [
   "BTCUSD",
   "ETHUSD",
@@ -59,78 +68,227 @@ NYSE_TICKERS = [
 ]
 
 LOOKBACK_DAYS = 365 * 2
+MEAN_REVERSION_FEATURES = ["zscore", "pct_change", "roc5", "rsi14"]
+ROWS_PER_TICKER = 1200
 
 
-def fetch_symbol_history(symbol: str, limit_days: int = LOOKBACK_DAYS) -> Optional[pd.DataFrame]:
+def _fetch_history_rows(tickers: List[str], date_filter: str) -> pd.DataFrame:
+  limit = ROWS_PER_TICKER * len(tickers)
   params = {
-    "select": "record_date,close_value",
-    "symbol": f"eq.{symbol}",
-    "order": "record_date.asc",
-    "limit": 1200,
+    "select": "symbol,record_date,close_value",
+    "symbol": f"in.({','.join(tickers)})",
+    "record_date": date_filter,
+    "order": "symbol.asc,record_date.asc",
+    "limit": limit,
   }
-  resp = requests.get(f"{SUPABASE_URL}/rest/v1/stock_market_history", headers=HEADERS, params=params, timeout=30)
-  if resp.status_code != 200:
-    print(f"[WARN] Failed to fetch {symbol}: {resp.status_code} {resp.text}")
-    return None
-  data = resp.json()
-  if not data:
-    print(f"[WARN] No data for {symbol}")
+  rows: List[Dict[str, object]] = []
+  # One request covers the whole universe; Supabase may cap the page size, so keep
+  # following offsets on the same connection until the result set is exhausted.
+  while len(rows) < limit:
+    resp = SESSION.get(
+      f"{SUPABASE_URL}/rest/v1/stock_market_history",
+      params={**params, "offset": len(rows)},
+      timeout=60,
+    )
+    if resp.status_code != 200:
+      raise RuntimeError(f"Failed to fetch history: {resp.status_code} {resp.text}")
+    page = resp.json()
+    if not page:
+      break
+    rows.extend(page)
+  if len(rows) >= limit:
+    # Rows are ordered by symbol, so the cap drops the newest days of the last symbols.
+    print(f"[WARN] History fetch hit the {limit}-row cap ({date_filter}); later symbols may be missing recent rows")
+
+  data = pd.DataFrame(rows, columns=["symbol", "record_date", "close_value"])
+  data["record_date"] = pd.to_datetime(data["record_date"])
+  data["close"] = pd.to_numeric(data["close_value"], errors="coerce")
+  return data.dropna(subset=["close"])[["symbol", "record_date", "close"]]
+
+
+def _load_history_cache() -> Optional[pd.DataFrame]:
+  if not HISTORY_CACHE.exists():
     return None
-  df = pd.DataFrame(data)
-  df["record_date"] = pd.to_datetime(df["record_date"])
-  cutoff = datetime.utcnow() - timedelta(days=limit_days)
-  df = df[df["record_date"] >= cutoff].copy()
-  df.sort_values("record_date", inplace=True)
-  df["close"] = pd.to_numeric(df["close_value"], errors="coerce")
-  df.dropna(subset=["close"], inplace=True)
-  if len(df) < 60:
-    print(f"[WARN] Not enough rows for {symbol}")
+  try:
+    return pd.read_parquet(HISTORY_CACHE)
+  except (OSError, ValueError) as exc:
+    print(f"[WARN] Ignoring unreadable history cache {HISTORY_CACHE}: {exc}")
     return None
-  return df
 
 
-def compute_rsi(series: pd.Series, period: int = 14) -> pd.Series:
-  delta = series.diff()
+def fetch_all_histories(tickers: List[str], limit_days: int = LOOKBACK_DAYS) -> Dict[str, pd.DataFrame]:
+  cutoff = pd.Timestamp(datetime.utcnow() - timedelta(days=limit_days)).normalize()
+  cached = _load_history_cache()
+  known = set() if cached is None else set(cached["symbol"].unique())
+  frames = [] if cached is None else [cached]
+  incremental = [symbol for symbol in tickers if symbol in known]
+  if incremental:
+    # Re-read the stalest cached day itself so a partial or late-corrected close is replaced,
+    # but never reach past the lookback window for a ticker that stopped updating.
+    last_seen = max(cached.groupby("symbol")["record_date"].max().loc[incremental].min(), cutoff)
+    date_filter = f"gte.{last_seen.date().isoformat()}"
+    fresh = _fetch_history_rows(incremental, date_filter)
+    print(f"[INFO] Fetched {len(fresh)} history rows for {len(incremental)} cached tickers ({date_filter})")
+    frames.append(fresh)
+  missing = [symbol for symbol in tickers if symbol not in known]
+  if missing:
+    date_filter = f"gte.{cutoff.date().isoformat()}"
+    fresh = _fetch_history_rows(missing, date_filter)
+    print(f"[INFO] Fetched {len(fresh)} history rows for {len(missing)} uncached tickers ({date_filter})")
+    frames.append(fresh)
+
+  frames = [frame for frame in frames if not frame.empty]
+  if not frames:
+    print("[WARN] No history returned for any ticker")
+    return {}
+  # Fresh rows come last, so they win over the cached copy of any overlapping day.
+  data = pd.concat(frames, ignore_index=True).drop_duplicates(subset=["symbol", "record_date"], keep="last")
+  data = data[data["record_date"] >= cutoff].sort_values(["symbol", "record_date"], ignore_index=True)
+  if data.empty:
+    print("[WARN] No history returned for any ticker")
+    return {}
+  data.to_parquet(HISTORY_CACHE, compression="zstd", index=False)
+
+  histories: Dict[str, pd.DataFrame] = {}
+  grouped = {symbol: sub for symbol, sub in data.groupby("symbol", sort=False)}
+  for symbol in tickers:
+    df = grouped.get(symbol)
+    if df is None:
+      print(f"[WARN] No data for {symbol}")
+      continue
+    df = df.reset_index(drop=True)
+    if len(df) < 60:
+      print(f"[WARN] Not enough rows for {symbol}")
+      continue
+    histories[symbol] = df
+  return histories
+
+
+def _ewm(values: np.ndarray, alpha: float) -> np.ndarray:
+  # Recursive EWM (pandas adjust=False); the recurrence runs in pandas' compiled ewm kernel.
+  return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+
+def compute_rsi(values: np.ndarray, period: int = 14) -> np.ndarray:
+  delta = np.diff(values, prepend=np.nan)
   gain = np.where(delta > 0, delta, 0.0)
   loss = np.where(delta < 0, -delta, 0.0)
-  roll_up = pd.Series(gain).ewm(alpha=1 / period, adjust=False).mean()
-  roll_down = pd.Series(loss).ewm(alpha=1 / period, adjust=False).mean()
-  rs = roll_up / roll_down
-  rsi = 100 - (100 / (1 + rs))
-  return pd.Series(rsi, index=series.index)
+  alpha = 1.0 / period
+  roll_up = _ewm(gain, alpha)
+  roll_down = _ewm(loss, alpha)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    return 100 - (100 / (1 + roll_up / roll_down))
+
+
+def _past_return(values: np.ndarray, lag: int) -> np.ndarray:
+  # values[t] / values[t - lag] - 1, NaN where the lag is not available (pandas pct_change(lag)).
+  out = np.full(values.shape[0], np.nan)
+  out[lag:] = values[lag:] / values[:-lag] - 1
+  return out
+
+
+def _future_return(values: np.ndarray, horizon: int) -> np.ndarray:
+  # values[t + horizon] / values[t] - 1, NaN for the last `horizon` rows.
+  out = np.full(values.shape[0], np.nan)
+  out[:-horizon] = values[horizon:] / values[:-horizon] - 1
+  return out
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+  # Trailing window mean from one uncentered running sum, NaN-padded on the left. For
+  # non-negative inputs the sum never decreases, so the result is never below 0.
+  mean = np.full(values.shape[0], np.nan)
+  if values.shape[0] < window:
+    return mean
+  cs = np.concatenate(([0.0], np.cumsum(values)))
+  mean[window - 1 :] = (cs[window:] - cs[:-window]) / window
+  return mean
+
+
+def rolling_mean_std(values: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+  # Trailing window mean and sample std (ddof=1, like pandas) from running sums, NaN-padded on the left.
+  n = values.shape[0]
+  mean = np.full(n, np.nan)
+  std = np.full(n, np.nan)
+  if n < window:
+    return mean, std
+  shift = values.mean()
+  centered = values - shift
+  cs = np.concatenate(([0.0], np.cumsum(centered)))
+  cs2 = np.concatenate(([0.0], np.cumsum(centered * centered)))
+  s = cs[window:] - cs[:-window]
+  s2 = cs2[window:] - cs2[:-window]
+  mean[window - 1 :] = s / window + shift
+  var = (s2 - s * s / window) / (window - 1)
+  # Flat windows would otherwise keep cancellation noise; pandas reports exactly 0 for them.
+  changes = np.concatenate(([0], np.cumsum(values[1:] != values[:-1])))
+  var[changes[window - 1 :] == changes[: n - window + 1]] = 0.0
+  std[window - 1 :] = np.sqrt(np.maximum(var, 0.0))
+  return mean, std
 
 
 def prepare_mean_reversion_features(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-  df = df.copy()
-  df["ma20"] = df["close"].rolling(20).mean()
-  df["std20"] = df["close"].rolling(20).std()
-  df["zscore"] = (df["close"] - df["ma20"]) / df["std20"]
-  df["pct_change"] = df["close"].pct_change()
-  df["roc5"] = df["close"].pct_change(5)
-  df["rsi14"] = compute_rsi(df["close"], 14)
-  df["future_return"] = df["close"].shift(-1) / df["close"] - 1
-  df["label"] = (df["future_return"] > 0).astype(int)
-  df = df.dropna().copy()
-  if len(df) < 100:
+  # Columns are computed on plain arrays and the frame is built once; no intermediate copies.
+  close = df["close"].to_numpy(dtype=np.float64)
+  ma20, std20 = rolling_mean_std(close, 20)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    zscore = (close - ma20) / std20
+  # A flat window has no z-score; NaN lets dropna() discard it instead of keeping +/-inf.
+  zscore[~np.isfinite(zscore)] = np.nan
+  future_return = _future_return(close, 1)
+  feats = pd.DataFrame(
+    {
+      "record_date": df["record_date"].to_numpy(),
+      "close": close,
+      "ma20": ma20,
+      "std20": std20,
+      "zscore": zscore,
+      "pct_change": _past_return(close, 1),
+      "roc5": _past_return(close, 5),
+      "rsi14": compute_rsi(close, 14),
+      "future_return": future_return,
+      "label": (future_return > 0).astype(int),
+    },
+    index=df.index,
+  ).dropna()
+  if len(feats) < 100:
     return None
-  return df
+  return feats
 
 
 def prepare_trend_features(df: pd.DataFrame, horizon: int = 5) -> Optional[pd.DataFrame]:
-  df = df.copy()
-  df["ema20"] = df["close"].ewm(span=20, adjust=False).mean()
-  df["ema50"] = df["close"].ewm(span=50, adjust=False).mean()
-  df["ema100"] = df["close"].ewm(span=100, adjust=False).mean()
-  df["ema_diff_short"] = df["ema20"] - df["ema50"]
-  df["ema_diff_long"] = df["ema50"] - df["ema100"]
-  df["momentum5"] = df["close"] / df["close"].shift(5) - 1
-  df["rsi14"] = compute_rsi(df["close"], 14)
-  df["atr"] = (df["close"].diff().abs()).rolling(14).mean()
-  df["future_return"] = df["close"].shift(-horizon) / df["close"] - 1
-  df = df.dropna().copy()
-  if len(df) < 150:
+  close = df["close"].to_numpy(dtype=np.float64)
+  ema20, ema50, ema100 = (_ewm(close, 2.0 / (span + 1)) for span in (20, 50, 100))
+  atr = np.concatenate(([np.nan], rolling_mean(np.abs(np.diff(close)), 14)))
+  feats = pd.DataFrame(
+    {
+      "record_date": df["record_date"].to_numpy(),
+      "close": close,
+      "ema20": ema20,
+      "ema50": ema50,
+      "ema100": ema100,
+      "ema_diff_short": ema20 - ema50,
+      "ema_diff_long": ema50 - ema100,
+      "momentum5": _past_return(close, 5),
+      "rsi14": compute_rsi(close, 14),
+      "atr": atr,
+      "future_return": _future_return(close, horizon),
+    },
+    index=df.index,
+  ).dropna()
+  if len(feats) < 150:
     return None
-  return df
+  return feats
+
+
+@dataclass
+class MeanReversionFit:
+  # A fitted model still waiting for the batched validation pass.
+  ticker: str
+  pipeline: Pipeline
+  feature_names: List[str]
+  X_val: np.ndarray
+  y_val: np.ndarray
 
 
 @dataclass
@@ -152,28 +310,45 @@ class TrendResult:
   feature_names: List[str]
 
 
-def train_mean_reversion(ticker: str, df: pd.DataFrame) -> Optional[MeanReversionResult]:
-  feats = prepare_mean_reversion_features(df)
-  if feats is None:
-    return None
-  feature_names = ["zscore", "pct_change", "roc5", "rsi14"]
-  X = feats[feature_names].values
+def fit_shared_scaler(feature_sets: List[pd.DataFrame]) -> StandardScaler:
+  # One scaler for the whole universe, fitted on the stacked training rows of every ticker.
+  train_rows = []
+  for feats in feature_sets:
+    X = feats[MEAN_REVERSION_FEATURES].to_numpy(dtype=np.float32)
+    train_rows.append(X[: int(len(X) * 0.8)])
+  return StandardScaler().fit(np.concatenate(train_rows))
+
+
+def train_mean_reversion(ticker: str, feats: pd.DataFrame, scaler: StandardScaler) -> Optional[MeanReversionFit]:
+  feature_names = list(MEAN_REVERSION_FEATURES)
+  X = feats[feature_names].to_numpy(dtype=np.float32)
   y = feats["label"].values
   split = int(len(X) * 0.8)
   if split == 0 or split == len(X):
     return None
   X_train, X_val = X[:split], X[split:]
   y_train, y_val = y[:split], y[split:]
-  pipe = Pipeline(
-    [
-      ("scaler", StandardScaler()),
-      ("model", LogisticRegression(max_iter=1000, class_weight="balanced")),
-    ]
-  )
-  pipe.fit(X_train, y_train)
-  preds = pipe.predict(X_val)
-  acc = accuracy_score(y_val, preds)
-  return MeanReversionResult(ticker, pipe, acc, feature_names)
+  model = LogisticRegression(max_iter=1000, class_weight="balanced")
+  model.fit(scaler.transform(X_train), y_train)
+  pipe = Pipeline([("scaler", scaler), ("model", model)])
+  # Scored later by evaluate_mean_reversion, which validates every ticker in one batch.
+  return MeanReversionFit(ticker, pipe, feature_names, X_val, y_val)
+
+
+def evaluate_mean_reversion(fits: List[MeanReversionFit], scaler: StandardScaler) -> List[float]:
+  # Stack all validation sets, scale them in one pass and evaluate every ticker's logit at once,
+  # each row picking up the coefficients of the model it belongs to.
+  sizes = [len(f.X_val) for f in fits]
+  owner = np.repeat(np.arange(len(fits)), sizes)
+  models: List[LogisticRegression] = [f.pipeline.named_steps["model"] for f in fits]
+  coef = np.vstack([m.coef_[0] for m in models])
+  intercept = np.array([m.intercept_[0] for m in models])
+  classes = np.vstack([m.classes_ for m in models])
+  Z = scaler.transform(np.concatenate([f.X_val for f in fits]))
+  logits = np.einsum("ij,ij->i", Z, coef[owner]) + intercept[owner]
+  preds = classes[owner, (logits > 0).astype(int)]
+  boundaries = np.cumsum(sizes)[:-1]
+  return [float(accuracy_score(f.y_val, y_pred)) for f, y_pred in zip(fits, np.split(preds, boundaries))]
 
 
 def train_trend_regressor(ticker: str, df: pd.DataFrame) -> Optional[TrendResult]:
@@ -181,7 +356,7 @@ def train_trend_regressor(ticker: str, df: pd.DataFrame) -> Optional[TrendResult
   if feats is None:
     return None
   feature_names = ["ema_diff_short", "ema_diff_long", "momentum5", "rsi14", "atr"]
-  X = feats[feature_names].values
+  X = feats[feature_names].to_numpy(dtype=np.float32)
   y = feats["future_return"].values
   split = int(len(X) * 0.8)
   if split == 0 or split == len(X):
@@ -190,7 +365,8 @@ def train_trend_regressor(ticker: str, df: pd.DataFrame) -> Optional[TrendResult
   y_train, y_val = y[:split], y[split:]
   pipe = Pipeline(
     [
-      ("model", HistGradientBoostingRegressor(max_depth=3, learning_rate=0.1, max_iter=200)),
+      # n_jobs=1: tickers are already trained in parallel, one per core.
+      ("model", LGBMRegressor(num_leaves=15, learning_rate=0.1, n_estimators=200, n_jobs=1, verbose=-1)),
     ]
   )
   pipe.fit(X_train, y_train)
@@ -202,6 +378,13 @@ def train_trend_regressor(ticker: str, df: pd.DataFrame) -> Optional[TrendResult
   return TrendResult(ticker, pipe, directional, rmse, mae, r2, feature_names)
 
 
+def _train_one(
+  ticker: str, df: pd.DataFrame, mean_feats: Optional[pd.DataFrame], scaler: StandardScaler
+) -> Tuple[Optional[MeanReversionFit], Optional[TrendResult]]:
+  mr = train_mean_reversion(ticker, mean_feats, scaler) if mean_feats is not None else None
+  return mr, train_trend_regressor(ticker, df)
+
+
 def save_mean_reversion_model(result: MeanReversionResult, results: List[Dict[str, float]]) -> None:
   scaler: StandardScaler = result.pipeline.named_steps["scaler"]
   model: LogisticRegression = result.pipeline.named_steps["model"]
@@ -210,22 +393,28 @@ def save_mean_reversion_model(result: MeanReversionResult, results: List[Dict[st
     "best_ticker": result.ticker,
     "accuracy": result.accuracy,
     "feature_names": result.feature_names,
-    "scaler_mean": scaler.mean_.tolist(),
-    "scaler_scale": scaler.scale_.tolist(),
-    "coefficients": model.coef_.tolist(),
-    "intercept": model.intercept_.tolist(),
+    "scaler_mean": scaler.mean_.astype(np.float32).tolist(),
+    "scaler_scale": scaler.scale_.astype(np.float32).tolist(),
+    "coefficients": model.coef_.astype(np.float32).tolist(),
+    "intercept": model.intercept_.astype(np.float32).tolist(),
     "per_ticker_accuracy": results,
   }
   (MODELS_DIR / "mean_reversion_model.json").write_text(json.dumps(payload, indent=2))
 
 
 def save_trend_model(result: TrendResult, results: List[Dict[str, float]]) -> None:
-  # Serialize model via joblib to keep tree structure
+  # Native LightGBM text format, kept alongside the ONNX export as the reference model.
+  model: LGBMRegressor = result.pipeline.named_steps["model"]
+  model.booster_.save_model(str(MODELS_DIR / "trend_model.txt"))
+  # ONNX export served by onnxruntime in the bot's predictor.
   try:
-    import joblib  # type: ignore
+    from onnxmltools import convert_lightgbm  # type: ignore
+    from onnxmltools.convert.common.data_types import FloatTensorType  # type: ignore
   except ImportError as exc:
-    raise RuntimeError("joblib is required to save the trend model. Add it to requirements.") from exc
-  joblib.dump(result.pipeline, MODELS_DIR / "trend_model.pkl")
+    raise RuntimeError("onnxmltools is required to export the trend model. Add it to requirements.") from exc
+  initial_types = [("X", FloatTensorType([None, len(result.feature_names)]))]
+  onnx_model = convert_lightgbm(model.booster_, initial_types=initial_types)
+  (MODELS_DIR / "trend_model.onnx").write_bytes(onnx_model.SerializeToString())
   payload = {
     "generated_at": datetime.utcnow().isoformat(),
     "best_ticker": result.ticker,
@@ -235,28 +424,41 @@ def save_trend_model(result: TrendResult, results: List[Dict[str, float]]) -> No
     "r2": result.r2,
     "feature_names": result.feature_names,
     "per_ticker_metrics": results,
-    "model_artifact": "ml-models/trend_model.pkl",
+    "model_artifact": "ml-models/trend_model.onnx",
   }
   (MODELS_DIR / "trend_model.json").write_text(json.dumps(payload, indent=2))
+  # The metadata no longer points at the pre-LightGBM joblib pipeline, so retire it.
+  (MODELS_DIR / "trend_model.pkl").unlink(missing_ok=True)
 
 
 def main() -> None:
   tickers = CRYPTO_TICKERS + NYSE_TICKERS
-  mean_results: List[MeanReversionResult] = []
-  trend_results: List[TrendResult] = []
-  for ticker in tickers:
-    df = fetch_symbol_history(ticker)
-    if df is None:
-      continue
-    mr = train_mean_reversion(ticker, df)
-    if mr:
-      mean_results.append(mr)
-    tr = train_trend_regressor(ticker, df)
-    if tr:
-      trend_results.append(tr)
-
-  if not mean_results:
+  histories = fetch_all_histories(tickers)
+
+  mean_features: Dict[str, pd.DataFrame] = {}
+  for ticker, df in histories.items():
+    feats = prepare_mean_reversion_features(df)
+    if feats is not None:
+      mean_features[ticker] = feats
+  if not mean_features:
     raise RuntimeError("Mean reversion training failed for all tickers.")
+  scaler = fit_shared_scaler(list(mean_features.values()))
+
+  # Each ticker is fitted independently, so spread the work across all cores.
+  results = Parallel(n_jobs=-1, backend="loky")(
+    delayed(_train_one)(ticker, histories[ticker], mean_features.get(ticker), scaler)
+    for ticker in tickers
+    if ticker in histories
+  )
+  mean_fits: List[MeanReversionFit] = [mr for mr, _ in results if mr]
+  trend_results: List[TrendResult] = [tr for _, tr in results if tr]
+
+  if not mean_fits:
+    raise RuntimeError("Mean reversion training failed for all tickers.")
+  mean_results = [
+    MeanReversionResult(f.ticker, f.pipeline, accuracy, f.feature_names)
+    for f, accuracy in zip(mean_fits, evaluate_mean_reversion(mean_fits, scaler))
+  ]
   if not trend_results:
     raise RuntimeError("Trend regressor training failed for all tickers.")
 
@@ -3,6 +3,8 @@ from typing import Literal, Sequence
 
 Action = Literal["buy", "sell", "hold"]
 
+WINDOW = 20
+
 
 @dataclass
 class MarketContext:
@@ -20,13 +22,21 @@ def decide_trade(context: MarketContext) -> Action:
     - Sell when the latest close is 1.5 std above the mean and we hold at least one lot.
     - Otherwise hold.
     """
-    closes = list(context.closes)[-20:]
-    if len(closes) < 20:
+    closes = context.closes
+    n = len(closes)
+    if n < WINDOW:
         return "hold"
 
-    mean_price = sum(closes) / len(closes)
-    variance = sum((price - mean_price) ** 2 for price in closes) / len(closes)
-    std_dev = variance ** 0.5
+    # Sums are taken relative to the window's first close so a flat window has zero variance.
+    anchor = closes[n - WINDOW]
+    total = total_sq = 0.0
+    for i in range(n - WINDOW, n):
+        delta = closes[i] - anchor
+        total += delta
+        total_sq += delta * delta
+    mean_delta = total / WINDOW
+    std_dev = max(total_sq / WINDOW - mean_delta * mean_delta, 0.0) ** 0.5
+    mean_price = anchor + mean_delta
     latest = closes[-1]
 
     if std_dev == 0:
@@ -1,3 +1,4 @@
+import math
 from dataclasses import dataclass
 from typing import Literal
 
@@ -5,7 +6,7 @@ Action = Literal["buy", "sell", "hold"]
 
 
 def sigmoid(x: float) -> float:
-  return 1 / (1 + pow(2.718281828459045, -x))
+  return 1 / (1 + math.exp(-x))
 
 
 @dataclass
@@ -13,9 +13,10 @@ def ema(prices: list[float], span: int) -> float:
 
 
 def atr(prices: list[float], period: int = 14) -> float:
-  diffs = [abs(prices[i] - prices[i - 1]) for i in range(1, len(prices))]
-  window = diffs[-period:]
-  return sum(window) / len(window)
+  # Only the last `period` deltas are averaged, so difference just the trailing window.
+  window = prices[-(period + 1) :]
+  diffs = [abs(window[i] - window[i - 1]) for i in range(1, len(window))]
+  return sum(diffs) / len(diffs)
 
 
 @dataclass
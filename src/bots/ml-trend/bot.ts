@@ -312,6 +312,9 @@ async function runTrendPrediction(modelPath: string, features: number[]): Promis
       }
       try {
         const parsed = JSON.parse(stdout.trim());
+        if (parsed && typeof parsed.error === "string") {
+          return reject(new Error(`Trend predictor rejected its input: ${parsed.error}`));
+        }
         const prediction = Number(parsed?.prediction);
         if (!Number.isFinite(prediction)) {
           throw new Error("Prediction payload missing value.");
@@ -1,26 +1,100 @@
-import json
 import sys
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any, Callable, Dict
 
-try:
-  import joblib  # type: ignore
-except ImportError as exc:  # pragma: no cover
-  raise SystemExit("joblib is required to load the trend model. Install scripts/ml/requirements.txt.") from exc
+import numpy as np
+import orjson
 
 
-def main() -> None:
-  raw = sys.stdin.read() or "{}"
-  payload = json.loads(raw)
-  model_path = Path(payload.get("modelPath") or "")
-  if not model_path.exists():
-    raise SystemExit(f"Model file not found at {model_path}")
+@dataclass
+class LoadedModel:
+  predict: Callable[[np.ndarray], np.ndarray]
+  n_features: int
+  # Input dtype the backend consumes, so it does not cast the row again.
+  dtype: Any
+
+
+def _load_onnx(model_path: str) -> LoadedModel:
+  try:
+    import onnxruntime as ort  # type: ignore
+  except ImportError as exc:  # pragma: no cover
+    raise SystemExit("onnxruntime is required to load the trend model. Install src/bots/requirements.txt.") from exc
+  session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+  graph_input = session.get_inputs()[0]
+  return LoadedModel(
+    predict=lambda x: session.run(None, {graph_input.name: x})[0].ravel(),
+    n_features=int(graph_input.shape[1]),
+    # The exported graph takes a float32 tensor.
+    dtype=np.float32,
+  )
+
+
+def _load_booster(model_path: str) -> LoadedModel:
+  try:
+    import lightgbm  # type: ignore
+  except ImportError as exc:  # pragma: no cover
+    raise SystemExit("lightgbm is required to load the trend model. Install scripts/ml/requirements.txt.") from exc
+  booster = lightgbm.Booster(model_file=model_path)
+  return LoadedModel(predict=booster.predict, n_features=booster.num_feature(), dtype=np.float64)
+
+
+def _load_pipeline(model_path: str) -> LoadedModel:
+  # Legacy joblib artifacts (sklearn Pipeline) produced before the switch to LightGBM.
+  # Only ml-models/trend_model.pkl is still served this way; drop this loader once a retrain has replaced it.
+  try:
+    import joblib  # type: ignore
+  except ImportError as exc:  # pragma: no cover
+    raise SystemExit("joblib is required to load the trend model. Install src/bots/requirements.txt.") from exc
+  pipeline = joblib.load(model_path)
+  steps = getattr(pipeline, "named_steps", {})
+  # The shipped pipeline is a lone "model" step; anything longer is served as a whole.
+  estimator = steps["model"] if list(steps) == ["model"] else pipeline
+  return LoadedModel(predict=estimator.predict, n_features=int(estimator.n_features_in_), dtype=np.float64)
+
+
+LOADERS = {
+  ".onnx": _load_onnx,
+  ".txt": _load_booster,
+  ".pkl": _load_pipeline,
+}
+
+
+def load_model(model_path: str) -> LoadedModel:
+  return LOADERS[Path(model_path).suffix](model_path)
+
+
+def predict(payload: Any) -> Dict[str, float]:
+  if not isinstance(payload, dict):
+    raise ValueError("Payload must be a JSON object.")
+  raw_path = payload.get("modelPath")
+  if not isinstance(raw_path, str) or not raw_path:
+    raise ValueError("modelPath must be a non-empty string.")
+  model_path = Path(raw_path)
+  if model_path.suffix not in LOADERS:
+    raise ValueError(f"Unsupported model format {model_path.suffix!r}; expected one of {', '.join(LOADERS)}.")
+  if not model_path.is_file():
+    raise ValueError(f"Model file not found at {model_path}")
   features = payload.get("features")
   if not isinstance(features, list):
-    raise SystemExit("Features payload must be a list.")
-  pipeline = joblib.load(model_path)
-  prediction = float(pipeline.predict([features])[0])
-  sys.stdout.write(json.dumps({"prediction": prediction}))
+    raise ValueError("Features payload must be a list.")
+  try:
+    model = load_model(str(model_path))
+  except Exception as exc:  # corrupt or mismatched artifact; answer with an error reply
+    raise ValueError(f"Failed to load model {model_path}: {exc}") from exc
+  if len(features) != model.n_features:
+    raise ValueError(f"Expected {model.n_features} features, got {len(features)}.")
+  x = np.asarray(features, dtype=model.dtype).reshape(1, -1)
+  return {"prediction": float(model.predict(x)[0])}
+
+
+def main() -> None:
+  try:
+    result = predict(orjson.loads(sys.stdin.buffer.read() or b"{}"))
+  except (TypeError, ValueError) as exc:
+    result = {"error": str(exc)}
+  sys.stdout.buffer.write(orjson.dumps(result) + b"\n")
 
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -1,7 +1,8 @@
-import json
 import sys
 from dataclasses import dataclass
 
+import orjson
+
 from bot import MarketContext, decide_trade
 
 
@@ -11,8 +12,10 @@ class LogicResult:
   reason: str
 
 
-def load_context() -> MarketContext:
-  raw = json.loads(sys.stdin.read() or "{}")
+def load_context(payload: bytes) -> MarketContext:
+  raw = orjson.loads(payload) if payload.strip() else {}
+  if not isinstance(raw, dict):
+    raise ValueError("Payload must be a JSON object.")
   return MarketContext(
     latest_price=float(raw.get("latestPrice", 0)),
     previous_price=float(raw.get("previousPrice", 0)),
@@ -30,11 +33,19 @@ def explain_decision(action: str) -> str:
   return "No strong signal, we maintain the current position."
 
 
-if __name__ == "__main__":
-  ctx = load_context()
+def run_logic(payload: bytes) -> LogicResult:
+  ctx = load_context(payload)
   action = decide_trade(ctx)
   result: LogicResult = {
     "action": action,
     "reason": explain_decision(action),
   }
-  print(json.dumps(result))
+  return result
+
+
+if __name__ == "__main__":
+  try:
+    result = run_logic(sys.stdin.buffer.read())
+  except (TypeError, ValueError) as exc:
+    result = {"error": str(exc)}
+  sys.stdout.buffer.write(orjson.dumps(result) + b"\n")
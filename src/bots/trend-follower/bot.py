@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Literal, Sequence
+from typing import Literal, Sequence, Tuple
 
 Action = Literal["buy", "sell", "hold"]
 
@@ -12,14 +12,28 @@ class MarketContext:
     lot_size: float
 
 
-def ema(values: Sequence[float], span: int) -> float:
-    if not values:
-        return 0.0
-    k = 2 / (span + 1)
-    ema_value = values[0]
-    for price in values[1:]:
-        ema_value = price * k + ema_value * (1 - k)
-    return ema_value
+def _ema_triplet(values: Sequence[float], fast: int, mid: int, slow: int) -> Tuple[float, float, float]:
+    # Single pass over the window maintaining all three EMAs at once. Each one accumulates the
+    # SMA of its first `span` closes as its seed, then switches to the EMA recurrence.
+    # Expects at least `slow` values.
+    k_fast = 2 / (fast + 1)
+    k_mid = 2 / (mid + 1)
+    k_slow = 2 / (slow + 1)
+    ema_fast = ema_mid = ema_slow = 0.0
+    for i, price in enumerate(values):
+        if i < fast:
+            ema_fast += price / fast
+        else:
+            ema_fast = price * k_fast + ema_fast * (1 - k_fast)
+        if i < mid:
+            ema_mid += price / mid
+        else:
+            ema_mid = price * k_mid + ema_mid * (1 - k_mid)
+        if i < slow:
+            ema_slow += price / slow
+        else:
+            ema_slow = price * k_slow + ema_slow * (1 - k_slow)
+    return ema_fast, ema_mid, ema_slow
 
 
 def decide_trade(context: MarketContext) -> Action:
@@ -30,13 +44,11 @@ def decide_trade(context: MarketContext) -> Action:
     - Sell when EMA20 < EMA50 < EMA200 and we hold at least one lot.
     - Otherwise hold.
     """
-    closes = list(context.closes)
+    closes = context.closes
     if len(closes) < 200:
         return "hold"
 
-    ema_20 = ema(closes[-200:], 20)
-    ema_50 = ema(closes[-200:], 50)
-    ema_200 = ema(closes[-200:], 200)
+    ema_20, ema_50, ema_200 = _ema_triplet(closes[-200:], 20, 50, 200)
 
     if ema_20 > ema_50 > ema_200 and context.cash_available >= closes[-1] * context.lot_size:
         return "buy"
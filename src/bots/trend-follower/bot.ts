@@ -220,6 +220,9 @@ async function runPythonLogic(input: LogicInput): Promise<LogicDecision> {
       }
       try {
         const parsed = JSON.parse(stdout.trim());
+        if (parsed && typeof parsed.error === "string") {
+          return reject(new Error(`Python logic rejected its input: ${parsed.error}`));
+        }
         resolve(parsed);
       } catch (err) {
         reject(new Error(`Failed to parse python output: ${stdout}\n${err}`));